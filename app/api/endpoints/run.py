@@ -3,14 +3,21 @@ from fastapi.responses import JSONResponse
 from app.schemas.models import RunRequest, IngestRequest
 from app.core.security import verify_token
 import asyncio
+import hashlib
 import json
-from typing import List
+from typing import List, Optional
 
 # Import your agent classes
 from app.services.three_retrieval_service import RetrievalService
 from app.services.one_planning_agent import PlanningAgent
 from app.services.two_synthesis_agent import SynthesisAgent
 from app.services.combined_agent import CombinedAgent
+from app.services.semantic_cache import SemanticAnswerCache
+from app.services.lru_cache import LRUCache
+from app.core.preload_state import (
+    clear_policy_preloaded, get_preloaded_policy_hash, mark_policy_preloaded,
+    release_rebuild_lock, try_acquire_rebuild_lock
+)
 
 # Create an API router
 router = APIRouter()
@@ -33,8 +40,11 @@ class ServiceManager:
             self.planning_agent = None
             self.synthesis_agent = None
             self.combined_agent = None
-            self.question_cache = {}
-            self.policy_preloaded = False
+            # Fallback-pipeline answers keyed by (question, context version); survives across requests
+            self.question_cache = LRUCache(maxsize=1024)
+            self.answer_cache = SemanticAnswerCache(similarity_threshold=0.95)
+            # Set once the index is known to match the local policy file's content hash
+            self.policy_index_verified = False
             self._initialized = True
     
     def initialize_services(self):
@@ -50,6 +60,14 @@ class ServiceManager:
 # Global service manager instance
 service_manager = ServiceManager()
 
+# Serializes index verification and rebuilds between concurrent requests in this worker
+_index_lock = asyncio.Lock()
+# How often a worker waiting on another process's rebuild re-checks the lock file
+REBUILD_LOCK_POLL_SECONDS = 2.0
+
+# Local policy document the index is built from
+POLICY_PATH = "./data/policy.pdf"
+
 # --- Main JSON Q&A Endpoint ---
 @router.post("/hackrx/run")
 async def run_submission(request: RunRequest, _token: str = Depends(verify_token)):
@@ -59,60 +77,169 @@ async def run_submission(request: RunRequest, _token: str = Depends(verify_token
     """
     service_manager.initialize_services()
 
-    policy_path = "./data/policy.pdf"
+    # Ensure an index is available and built from the current policy file; otherwise recreate it.
+    # Normally already done at startup, so this is only a flag check.
+    await prepare_policy_index()
+
+    questions = request.questions
+    retrieval_service = service_manager.retrieval_service
+    context_version = retrieval_service.context_version
+
+    # Serve semantically matching questions answered earlier against the same index version
+    question_embeddings = await asyncio.to_thread(retrieval_service.encode_queries, questions)
+    answers = service_manager.answer_cache.lookup_many(question_embeddings, context_version)
+    pending_indices = [i for i, answer in enumerate(answers) if answer is None]
+    if len(pending_indices) < len(questions):
+        print(f"♻️ Served {len(questions) - len(pending_indices)} answers from the semantic cache")
+    pending_questions = [questions[i] for i in pending_indices]
 
-    # Ensure an index is available; if missing, recreate from local policy file
-    if service_manager.retrieval_service.index is None:
+    # Process all questions using the combined agent with retry logic
+    if pending_questions:
         try:
-            print(f"🆕 No Pinecone index found. Creating from local policy file: {policy_path}")
-            await asyncio.to_thread(service_manager.retrieval_service.ingest_and_process_pdf, policy_path)
-            print(f"✅ Successfully created Pinecone index from: {policy_path}")
-            service_manager.policy_preloaded = True
-        except Exception as e:
-            print(f"❌ Failed to create Pinecone index from local file: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to (re)create Pinecone index from local policy file: {e}"
+            print(f"🚀 Processing {len(pending_questions)} questions with combined agent...")
+            
+            # Get all relevant context chunks for all questions
+            all_context_chunks = await get_comprehensive_context(pending_questions)
+            
+            # Process all questions in a single API call
+            pending_answers = await service_manager.combined_agent.process_all_questions_with_retry(
+                questions=pending_questions,
+                context_chunks=all_context_chunks,
+                max_retries=2
             )
+            
+            print(f"✅ Successfully processed all {len(pending_answers)} questions")
+
+        except Exception as e:
+            print(f"Error processing questions: {e}")
+            # Fallback: process questions individually
+            pending_answers = []
+            for i, question in enumerate(pending_questions):
+                try:
+                    print(f"Processing question {i+1}/{len(pending_questions)}: {question}")
+                    answer = await run_single_question_pipeline(question)
+                    pending_answers.append(answer)
+                except Exception as e:
+                    print(f"Error processing question '{question}': {e}")
+                    error_message = f"An error occurred while processing the question: {question}"
+                    pending_answers.append(error_message)
+
+        for i, answer in zip(pending_indices, pending_answers):
+            answers[i] = answer
+            if _is_cacheable_answer(answer):
+                service_manager.answer_cache.store(question_embeddings[i], questions[i], answer, context_version)
+
+    # Return JSON response with answers array
+    return JSONResponse(content={"answers": answers})
+
+async def prepare_policy_index():
+    """
+    Makes sure the Pinecone index is present and matches the local policy file,
+    rebuilding it if not. Called at startup and, as a cheap flag check, per request.
+    """
+    if service_manager.retrieval_service.index is None or not service_manager.policy_index_verified:
+        async with _index_lock:
+            await ensure_policy_index(POLICY_PATH)
     else:
         print("📊 Using existing Pinecone index - skipping ingestion step")
-        service_manager.policy_preloaded = True
 
-    # Always clear cache for fresh answers per request batch
-    service_manager.question_cache.clear()
+async def ensure_policy_index(policy_path: str):
+    """
+    Verifies the Pinecone index against the local policy file and rebuilds it if
+    needed. Must be called with _index_lock held; the state is re-checked here since
+    a request that held the lock before may already have done the work.
+
+    Rebuilds are also serialized across worker processes with the host-wide rebuild
+    lock file. A worker that had to wait re-attaches to the index the other process
+    built and only rebuilds again if it still does not match the policy file.
+    """
+    retrieval_service = service_manager.retrieval_service
+    rebuild_reason = None
+    if retrieval_service.index is None:
+        rebuild_reason = "No Pinecone index found"
+    elif not service_manager.policy_index_verified:
+        rebuild_reason = await get_policy_index_rebuild_reason(policy_path)
+
+    if not rebuild_reason:
+        print("📊 Using existing Pinecone index - skipping ingestion step")
+        return
+
+    waited = False
+    while not try_acquire_rebuild_lock():
+        if not waited:
+            print("⏳ Another process is rebuilding the Pinecone index, waiting...")
+        waited = True
+        await asyncio.sleep(REBUILD_LOCK_POLL_SECONDS)
 
-    # Process all questions using the combined agent with retry logic
     try:
-        print(f"🚀 Processing {len(request.questions)} questions with combined agent...")
-        
-        # Get all relevant context chunks for all questions
-        all_context_chunks = await get_comprehensive_context(request.questions)
-        
-        # Process all questions in a single API call
-        answers = await service_manager.combined_agent.process_all_questions_with_retry(
-            questions=request.questions,
-            context_chunks=all_context_chunks,
-            max_retries=2
+        if waited and await asyncio.to_thread(retrieval_service.attach_existing_index):
+            rebuild_reason = await get_policy_index_rebuild_reason(policy_path)
+            if not rebuild_reason:
+                return
+
+        print(f"🆕 {rebuild_reason}. Creating from local policy file: {policy_path}")
+        clear_policy_preloaded()
+        await asyncio.to_thread(retrieval_service.ingest_and_process_pdf, policy_path)
+        print(f"✅ Successfully created Pinecone index from: {policy_path}")
+        pdf_hash = await asyncio.to_thread(retrieval_service.compute_file_hash, policy_path)
+        mark_policy_preloaded(pdf_hash)
+        service_manager.policy_index_verified = True
+    except Exception as e:
+        print(f"❌ Failed to create Pinecone index from local file: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to (re)create Pinecone index from local policy file: {e}"
         )
-        
-        print(f"✅ Successfully processed all {len(answers)} questions")
+    finally:
+        release_rebuild_lock()
+
+async def get_policy_index_rebuild_reason(policy_path: str) -> Optional[str]:
+    """
+    Compares the local policy file's content hash with the hash recorded in the index.
+    Returns why the index must be rebuilt, or None if it can be used as is. If the
+    check itself fails, the existing index is kept and the check is retried next request.
 
+    A preload sentinel written by any process for the same file content is trusted
+    without asking Pinecone, so workers sharing a host verify the index only once.
+    """
+    retrieval_service = service_manager.retrieval_service
+    try:
+        pdf_hash = await asyncio.to_thread(retrieval_service.compute_file_hash, policy_path)
+        preloaded_hash = get_preloaded_policy_hash()
+        if preloaded_hash == pdf_hash:
+            print("📌 Policy marked as preloaded - skipping index verification")
+            service_manager.policy_index_verified = True
+            return None
+        indexed_hash = await asyncio.to_thread(retrieval_service.get_indexed_pdf_hash)
     except Exception as e:
-        print(f"Error processing questions: {e}")
-        # Fallback: process questions individually
-        answers = []
-        for i, question in enumerate(request.questions):
-            try:
-                print(f"Processing question {i+1}/{len(request.questions)}: {question}")
-                answer = await run_single_question_pipeline(question)
-                answers.append(answer)
-            except Exception as e:
-                print(f"Error processing question '{question}': {e}")
-                error_message = f"An error occurred while processing the question: {question}"
-                answers.append(error_message)
+        print(f"Warning: Could not verify the Pinecone index against {policy_path}: {e}")
+        return None
 
-    # Return JSON response with answers array
-    return JSONResponse(content={"answers": answers})
+    if indexed_hash != pdf_hash:
+        return "Policy file does not match the existing Pinecone index"
+
+    print("🔒 Pinecone index matches the local policy file")
+    mark_policy_preloaded(pdf_hash)
+    service_manager.policy_index_verified = True
+    return None
+
+def _question_cache_key(question: str, context_version: int) -> bytes:
+    """
+    Compact cache key for a question under a given index version; a rebuilt index
+    gets a new version, so answers from the old policy are never served.
+    """
+    return hashlib.blake2b(f"{context_version}\x00{question}".encode(), digest_size=16).digest()
+
+def _is_cacheable_answer(answer: str) -> bool:
+    """
+    Only real answers are cached; placeholders and error messages are retried on the next request.
+    """
+    return bool(answer) and not answer.startswith((
+        "Information not found in the policy document",
+        "An error occurred while processing the question",
+        "I couldn't find specific information",
+        "[An error occurred",
+    ))
 
 async def get_comprehensive_context(questions: List[str]) -> List[str]:
     """
@@ -120,22 +247,24 @@ async def get_comprehensive_context(questions: List[str]) -> List[str]:
     """
     print("🔍 Gathering comprehensive context for all questions...")
     
-    all_context_chunks = set()
+    # Deduplicate on the short Pinecone match id rather than hashing the chunk text
+    seen_ids = set()
+    context_list = []
     
-    # Use a higher top_k for comprehensive context gathering
-    for question in questions:
-        try:
-            # Get context for each question
-            context = await asyncio.to_thread(
-                service_manager.retrieval_service.search_and_rerank, 
-                question, 
-                top_k_retrieval=30  # Higher retrieval for better coverage
-            )
-            all_context_chunks.update(context)
-        except Exception as e:
-            print(f"Warning: Could not get context for question '{question}': {e}")
+    # Retrieve context for all questions in one batched call, using a higher top_k for coverage
+    try:
+        contexts = await service_manager.retrieval_service.search_and_rerank_batch(
+            questions,
+            top_k_retrieval=30  # Higher retrieval for better coverage
+        )
+        for context in contexts:
+            for match_id, text, _ in context:
+                if match_id not in seen_ids:
+                    seen_ids.add(match_id)
+                    context_list.append(text)
+    except Exception as e:
+        print(f"Warning: Could not get context for questions: {e}")
     
-    context_list = list(all_context_chunks)
     print(f"📚 Retrieved {len(context_list)} unique context chunks for all questions")
     
     return context_list
@@ -147,42 +276,72 @@ async def run_single_question_pipeline(question: str) -> str:
     """
     print(f"\n--- Processing Question: {question} ---")
     
-    if question in service_manager.question_cache:
+    cache_key = _question_cache_key(question, service_manager.retrieval_service.context_version)
+    cached_answer = service_manager.question_cache.get(cache_key)
+    if cached_answer is not None:
         print("Found in cache.")
-        return service_manager.question_cache[question]
+        return cached_answer
 
-    # 1. Planning Agent: Decomposes and generates hypothetical answers in one call
-    research_plan = service_manager.planning_agent.plan_and_research(question)
+    # 1. Planning Agent: Decomposes and generates hypothetical answers in one call.
+    # Retrieval for the raw question runs speculatively while the plan is generated.
+    research_plan, speculative_context = await asyncio.gather(
+        service_manager.planning_agent.plan_and_research(question),
+        service_manager.retrieval_service.search_and_rerank_batch([question], top_k_retrieval=40),
+        return_exceptions=True
+    )
+    if isinstance(research_plan, BaseException):
+        print(f"Error in planning step: {research_plan}")
+        research_plan = {question: [question]}
+    if isinstance(speculative_context, BaseException):
+        print(f"Warning: Speculative retrieval failed: {speculative_context}")
+        speculative_context = []
+    else:
+        speculative_context = speculative_context[0]
     print(f"Research plan generated: {len(research_plan)} sub-question(s)")
 
+    # The speculative chunks are only reused when the plan did not decompose the question
+    use_speculative = bool(speculative_context) and list(research_plan) == [question]
+
+    # All hypothetical answers seek the same ground truth, so they are searched together
+    all_hypotheticals = list(dict.fromkeys(ha for hypos in research_plan.values() for ha in hypos))
+
     # 2. Concurrent Context Retrieval with retry logic
-    all_context_chunks = set()
+    # Chunks are deduplicated on their Pinecone match id, keeping first-seen order
+    seen_ids = set()
+    all_context_chunks = []
+    # Token counts recorded at ingest, parallel to all_context_chunks
+    all_token_counts = []
     max_retries = 2
     
     for attempt in range(max_retries):
-        async def get_context_for_sub_q(sub_q: str, hypothetical_answers: list):
-            local_chunks = set()
+        if attempt == 0 and use_speculative:
+            print("Reusing speculative retrieval for the undecomposed question.")
+            attempt_context = speculative_context
+        else:
             # Increase top_k on retry attempts
             top_k = 60 if attempt > 0 else (40 if len(research_plan) > 1 else 20)
-            for ha in hypothetical_answers:
-                context = await asyncio.to_thread(service_manager.retrieval_service.search_and_rerank, ha, top_k_retrieval=top_k)
-                local_chunks.update(context)
-            return local_chunks
-
-        tasks = [get_context_for_sub_q(sub_q, hypos) for sub_q, hypos in research_plan.items()]
-        results = await asyncio.gather(*tasks)
-        
-        # Collect all chunks from this attempt
-        attempt_chunks = set()
-        for chunk_set in results:
-            attempt_chunks.update(chunk_set)
+            # One batched search over every hypothetical, reranked once against the
+            # original question; keep as many chunks as the per-hypothetical searches did
+            attempt_context = await service_manager.retrieval_service.search_and_rerank_merged(
+                question,
+                all_hypotheticals,
+                top_k_retrieval=top_k,
+                top_n_rerank=5 * len(all_hypotheticals)
+            )
         
-        all_context_chunks.update(attempt_chunks)
+        # Collect all new chunks from this attempt
+        attempt_chunk_count = 0
+        for match_id, text, tokens in attempt_context:
+            if match_id not in seen_ids:
+                seen_ids.add(match_id)
+                all_context_chunks.append(text)
+                all_token_counts.append(tokens)
+                attempt_chunk_count += 1
         
-        print(f"Retrieved {len(attempt_chunks)} unique context chunks (attempt {attempt + 1}/{max_retries}).")
+        print(f"Retrieved {attempt_chunk_count} unique context chunks (attempt {attempt + 1}/{max_retries}).")
         
         # If we found chunks, break out of retry loop
-        if attempt_chunks:
+        if attempt_chunk_count:
             break
         elif attempt < max_retries - 1:
             print(f"⚠️ No relevant chunks found on attempt {attempt + 1}, retrying with more chunks...")
@@ -194,9 +353,10 @@ async def run_single_question_pipeline(question: str) -> str:
     print(f"Retrieved {len(all_context_chunks)} unique context chunks.")
 
     # 3. Synthesis Agent: Generates the final answer
-    final_answer = await service_manager.synthesis_agent.synthesize_final_answer(question, list(all_context_chunks))
+    final_answer = await service_manager.synthesis_agent.synthesize_final_answer(question, all_context_chunks, all_token_counts)
     
-    # Cache the answer
-    service_manager.question_cache[question] = final_answer
+    # Cache the answer; error placeholders are retried on the next request
+    if _is_cacheable_answer(final_answer):
+        service_manager.question_cache.set(cache_key, final_answer)
     
     return final_answer
@@ -16,5 +16,11 @@ class Settings(BaseSettings):
     # Bearer token is now optional, allowing it to be provided via the UI
     HACKATHON_BEARER_TOKEN: Optional[str] = None
 
+    # Run the retrieval models at reduced precision (FP16 on GPU, int8 on CPU)
+    QUANTIZE_RETRIEVAL_MODELS: bool = True
+
+    # Sentinel file shared by all worker processes; its presence marks the policy as preloaded
+    POLICY_PRELOADED_SENTINEL: str = "/tmp/.policy_preloaded"
+
 # Create a single, globally accessible instance of the settings
 settings = Settings()
@@ -0,0 +1,90 @@
+import os
+import time
+from typing import Optional
+from app.core.config import settings
+
+# A rebuild lock older than this is assumed to belong to a crashed process
+REBUILD_LOCK_STALE_SECONDS = 30 * 60
+
+def mark_policy_preloaded(pdf_hash: str):
+    """
+    Records that the Pinecone index holds the preloaded policy document by writing
+    the sentinel file shared by every worker process on this host.
+
+    The file is written under a temporary name and renamed into place, so readers
+    never see a partially written sentinel.
+
+    Args:
+        pdf_hash: Content hash of the preloaded policy file. Workers only trust the
+                  index while the local policy file still has this hash.
+    """
+    path = settings.POLICY_PRELOADED_SENTINEL
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(pdf_hash)
+    os.replace(tmp_path, path)
+
+def clear_policy_preloaded():
+    """
+    Removes the sentinel file, e.g. before the index is deleted and rebuilt.
+    """
+    try:
+        os.remove(settings.POLICY_PRELOADED_SENTINEL)
+    except FileNotFoundError:
+        pass
+
+def is_policy_preloaded() -> bool:
+    """
+    Returns True if some process has marked the policy document as preloaded.
+    """
+    return os.path.exists(settings.POLICY_PRELOADED_SENTINEL)
+
+def get_preloaded_policy_hash() -> Optional[str]:
+    """
+    Returns the content hash recorded in the sentinel file, or None if the policy
+    has not been marked as preloaded.
+    """
+    try:
+        with open(settings.POLICY_PRELOADED_SENTINEL, encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _rebuild_lock_path() -> str:
+    return settings.POLICY_PRELOADED_SENTINEL + ".lock"
+
+def try_acquire_rebuild_lock() -> bool:
+    """
+    Takes the host-wide index rebuild lock by exclusively creating the lock file
+    (O_CREAT | O_EXCL), so only one process deletes and rebuilds the shared index
+    at a time. The preload sentinel is only a flag and cannot provide this.
+
+    Returns:
+        True if the lock was taken, False if another process holds it. A lock older
+        than REBUILD_LOCK_STALE_SECONDS is broken and taken over.
+    """
+    path = _rebuild_lock_path()
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) <= REBUILD_LOCK_STALE_SECONDS:
+                    return False
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+        return True
+    return False
+
+def release_rebuild_lock():
+    """
+    Releases the host-wide index rebuild lock.
+    """
+    try:
+        os.remove(_rebuild_lock_path())
+    except FileNotFoundError:
+        pass
@@ -1,3 +1,5 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
@@ -5,11 +7,39 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.api.endpoints import run as run_router
 import os
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Loads the models and attaches to the Pinecone index at startup, runs a warmup
+    pass over the retrieval models and the Gemini connection, then verifies (and if
+    needed rebuilds) the index, so the first real request lands on a warm service.
+    """
+    try:
+        await asyncio.to_thread(run_router.service_manager.initialize_services)
+        await asyncio.gather(
+            asyncio.to_thread(run_router.service_manager.retrieval_service.warm_up),
+            run_router.service_manager.synthesis_agent.warm_up()
+        )
+    except Exception as e:
+        # Services are initialized lazily on the first request if startup fails
+        print(f"Warning: Could not initialize services at startup: {e}")
+    if run_router.service_manager.retrieval_service is not None:
+        try:
+            # Verify (and if needed rebuild) the index now, so no request pays for it
+            await run_router.prepare_policy_index()
+        except Exception as e:
+            # Verification is retried on the first request if it fails here
+            print(f"Warning: Could not verify the Pinecone index at startup: {e}")
+    yield
+    if run_router.service_manager.retrieval_service is not None:
+        await run_router.service_manager.retrieval_service.aclose()
+
 # Create the FastAPI application instance
 app = FastAPI(
     title="Hackathon Retrieval System API",
     description="An advanced multi-agent RAG system for document question answering.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # --- Add CORS Middleware ---
@@ -0,0 +1,119 @@
+"""
+Preload Policy Document Script
+This script preloads the policy document into the vector database
+so it's ready for queries without processing it every time.
+
+Run from the project root with: python -m app.scripts.preload_policy
+"""
+
+import asyncio
+import logging
+import sys
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from app.core.preload_state import clear_policy_preloaded, mark_policy_preloaded, release_rebuild_lock, try_acquire_rebuild_lock
+from app.services.three_retrieval_service import RetrievalService, extract_pdf_text
+
+logger = logging.getLogger("preload")
+
+# Page-range shard size for parallel PDF parsing
+PAGES_PER_SHARD = 32
+
+async def parse_pdf_parallel(retrieval_service: RetrievalService, pdf_bytes: bytes) -> str:
+    """
+    Extracts the PDF text in page-range shards parsed concurrently in worker
+    processes (at most one per CPU), then joins them in page order.
+    """
+    page_count = await asyncio.to_thread(retrieval_service.count_pdf_pages, pdf_bytes)
+    shards = [(start, min(start + PAGES_PER_SHARD, page_count)) for start in range(0, page_count, PAGES_PER_SHARD)]
+    if len(shards) <= 1:
+        return await asyncio.to_thread(retrieval_service.parse_pdf, pdf_bytes)
+
+    logger.info(f"📑 Parsing {page_count} pages in {len(shards)} parallel shards...")
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=min(len(shards), os.cpu_count() or 1)) as pool:
+        shard_texts = await asyncio.gather(*[
+            loop.run_in_executor(pool, extract_pdf_text, pdf_bytes, start, end)
+            for start, end in shards
+        ])
+    return "".join(shard_texts)
+
+async def run_ingest_pipeline(retrieval_service: RetrievalService, pdf_bytes: bytes):
+    """
+    Ingests the in-memory policy document: the PDF is parsed in parallel shards, then
+    chunked, embedded and upserted by RetrievalService.ingest_text, the same ingest
+    the API uses when it rebuilds the index.
+    """
+    pdf_hash = retrieval_service.compute_bytes_hash(pdf_bytes)
+    full_text = await parse_pdf_parallel(retrieval_service, pdf_bytes)
+
+    clear_policy_preloaded()
+    await asyncio.to_thread(retrieval_service.ingest_text, full_text, pdf_hash)
+    logger.info(f"⬆️ Upserted {len(retrieval_service.text_chunks)} vectors to Pinecone.")
+
+    # Lets every API worker process skip ingestion and index verification
+    mark_policy_preloaded(pdf_hash)
+
+async def preload_policy_document():
+    """
+    Preloads the policy document into the vector database.
+    """
+    logger.info("🚀 Starting policy document preload...")
+    
+    # Initialize the retrieval service
+    retrieval_service = RetrievalService()
+    
+    # Path to the policy document
+    policy_path = "./data/policy.pdf"
+    
+    if not os.path.exists(policy_path):
+        logger.error(f"❌ Error: Policy document not found at {policy_path}")
+        logger.error("Please ensure the policy.pdf file is in the ./data directory")
+        return False
+    
+    try:
+        logger.info(f"📄 Processing policy document: {policy_path}")
+        
+        # Only one process may delete and rebuild the shared index at a time
+        if not try_acquire_rebuild_lock():
+            logger.error("❌ Error: Another process is already rebuilding the Pinecone index")
+            return False
+        try:
+            # Process the PDF and upload to vector database
+            # The file is read once; every later stage works on the in-memory bytes
+            pdf_bytes = await asyncio.to_thread(Path(policy_path).read_bytes)
+            await run_ingest_pipeline(retrieval_service, pdf_bytes)
+        finally:
+            release_rebuild_lock()
+        
+        logger.info("✅ Policy document successfully preloaded into vector database!")
+        logger.info("📊 Document is now ready for queries without processing delay.")
+        
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Error preloading policy document: {e}")
+        return False
+
+def main():
+    """
+    Main function to run the preload script.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logger.info("🔧 POLICY DOCUMENT PRELOAD SCRIPT")
+    
+    # Run the preload
+    success = asyncio.run(preload_policy_document())
+    
+    if success:
+        logger.info("🎉 Preload completed successfully!")
+        logger.info("💡 You can now use the API without document processing delays.")
+        logger.info("📝 Use './data/policy.pdf' as the documents parameter in your API calls.")
+    else:
+        logger.error("💥 Preload failed. Please check the error messages above.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main() 
\ No newline at end of file
@@ -0,0 +1,36 @@
+"""
+Script to manually mark the policy document as preloaded for every API worker.
+
+Run from the project root with: python -m app.scripts.set_preloaded
+"""
+
+import logging
+import os
+import sys
+
+from app.core.config import settings
+from app.core.preload_state import is_policy_preloaded, mark_policy_preloaded
+from app.services.three_retrieval_service import RetrievalService
+
+logger = logging.getLogger("preload")
+
+POLICY_PATH = "./data/policy.pdf"
+
+def set_preloaded_state():
+    """
+    Writes the shared preload sentinel with the local policy file's content hash, so
+    all worker processes trust the existing index until the policy file changes.
+    """
+    if not os.path.exists(POLICY_PATH):
+        logger.error(f"❌ Error: Policy document not found at {POLICY_PATH}")
+        sys.exit(1)
+
+    logger.info("🔧 Marking policy document as preloaded...")
+    mark_policy_preloaded(RetrievalService.compute_file_hash(POLICY_PATH))
+    logger.info(f"✅ Preload sentinel written to {settings.POLICY_PRELOADED_SENTINEL}")
+    logger.info("📝 Next API request should skip document processing")
+    logger.info(f"🔍 Current state: policy preloaded = {is_policy_preloaded()}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    set_preloaded_state() 
@@ -0,0 +1,23 @@
+"""
+Test script to manually set the preloaded flag and verify document processing is skipped.
+
+Run from the project root with: python -m app.scripts.test_preloaded
+"""
+
+# Import the shared preload state used by the run endpoint
+from app.core.preload_state import is_policy_preloaded, mark_policy_preloaded
+from app.services.three_retrieval_service import RetrievalService
+
+POLICY_PATH = "./data/policy.pdf"
+
+def set_preloaded_flag():
+    """
+    Manually marks the current policy file as preloaded to test skipping document processing.
+    """
+    print("🔧 Setting policy preloaded flag...")
+    mark_policy_preloaded(RetrievalService.compute_file_hash(POLICY_PATH))
+    print(f"✅ policy preloaded flag set: {is_policy_preloaded()}")
+    print("📝 Next API request should skip document processing")
+
+if __name__ == "__main__":
+    set_preloaded_flag() 
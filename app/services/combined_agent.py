@@ -1,3 +1,5 @@
+import io
+import re
 import google.generativeai as genai
 from typing import List, Dict
 from app.core.config import settings
@@ -5,12 +7,81 @@ from app.core.config import settings
 # Configure the Gemini client with your API key
 genai.configure(api_key=settings.GOOGLE_API_KEY)
 
+# --- Prompt templates, built once at import time ---
+# Static rules that seed every chat; the Source Text is appended after this head.
+_SEED_PROMPT_HEAD = """
+You are a precise and factual insurance policy assistant. Your task is to answer questions about the National Parivar Mediclaim Plus Policy based ONLY on the provided 'Source Text'.
+
+CRITICAL RULES:
+- Answer each question CONCISELY (1-2 sentences maximum)
+- Use ONLY information from the Source Text
+- Be direct and factual
+- If information is not found, respond exactly: "Information not found in the policy document"
+- Number your answers to match the question numbers
+
+Source Text:
+"""
+
+_SEED_MODEL_ACK = "Understood. I will answer only from the Source Text, using numbered answers."
+
+_ALL_QUESTIONS_TEMPLATE = """
+Questions to Answer:
+{questions}
+
+Instructions:
+Provide your answers in this exact format:
+1. [Answer to question 1]
+2. [Answer to question 2]
+3. [Answer to question 3]
+... and so on for all questions.
+
+Final Answers:
+"""
+
+_MISSING_QUESTIONS_TEMPLATE = """
+Answer ONLY the listed question numbers. Number your answers to match the ORIGINAL question numbers provided below.
+
+Questions to Answer (use these original numbers in your answers):
+{questions}
+
+Instructions:
+Provide your answers in this exact format using the original numbers:
+{answer_format}
+
+Final Answers:
+"""
+
+_SINGLE_PROMPT_HEAD = """
+You are a precise and factual insurance policy assistant. Answer the following question based ONLY on the provided 'Source Text'.
+
+CRITICAL RULES:
+- Answer CONCISELY (1-2 sentences maximum)
+- Use ONLY information from the Source Text
+- Be direct and factual
+- If information is not found, respond exactly: "Information not found in the policy document"
+
+Source Text:
+"""
+
+_SINGLE_PROMPT_MID = """
+
+Question:
+"""
+
+_SINGLE_PROMPT_TAIL = """
+
+Answer:
+"""
+
 class CombinedAgent:
     """
     A highly efficient agent that processes all questions in a single API call
     to minimize processing time and includes retry logic for better accuracy.
     """
     
+    # Fallback for numbered lines the fast path rejects, e.g. markdown-emphasized "**12.** answer..."
+    _ANSWER_LINE_RE = re.compile(r'^[*_]*(\d+)\.[*_]*[ \t]*(\S.*)$')
+    
     def __init__(self):
         """
         Initializes the CombinedAgent with optimized Gemini model configuration.
@@ -39,40 +110,21 @@ class CombinedAgent:
         Returns:
             List of answers corresponding to the questions (same order)
         """
-        context_str = "\n\n---\n\n".join(context_chunks)
+        context_str = self._join_context(context_chunks)
+        
+        # Seed a chat session with the rules and Source Text once; each attempt then
+        # only sends its questions, so the large prefix is built a single time.
+        history = self._build_seed_history(context_str)
         
-        # Build first-pass prompt for all questions
+        # Build first-pass message for all questions
         questions_text = "\n".join([f"{i+1}. {question}" for i, question in enumerate(questions)])
-        prompt_all = f"""
-You are a precise and factual insurance policy assistant. Your task is to answer multiple questions about the National Parivar Mediclaim Plus Policy based ONLY on the provided 'Source Text'.
-
-CRITICAL RULES:
-- Answer each question CONCISELY (1-2 sentences maximum)
-- Use ONLY information from the Source Text
-- Be direct and factual
-- If information is not found, respond exactly: "Information not found in the policy document"
-- Number your answers to match the question numbers
-
-Source Text:
-{context_str}
-
-Questions to Answer:
-{questions_text}
-
-Instructions:
-Provide your answers in this exact format:
-1. [Answer to question 1]
-2. [Answer to question 2]
-3. [Answer to question 3]
-... and so on for all questions.
-
-Final Answers:
-"""
+        message_all = _ALL_QUESTIONS_TEMPLATE.format(questions=questions_text)
 
         # First attempt: answer all
         print("🔄 Processing all questions (attempt 1)")
         try:
-            response = await self.model.generate_content_async(prompt_all)
+            chat = self.model.start_chat(history=history)
+            response = await chat.send_message_async(message_all)
             response_text = response.text.strip()
             answers_map = self._parse_numbered_answers_map(response_text)
         except Exception as e:
@@ -90,30 +142,15 @@ Final Answers:
         # Second attempt: only retry unanswered questions
         print(f"🔁 Retrying only unanswered questions (attempt 2) for indices: {[i+1 for i in missing_indices]}")
         missing_questions_text = "\n".join([f"{(i+1)}. {questions[i]}" for i in missing_indices])
-        prompt_missing = f"""
-You are a precise and factual insurance policy assistant. Answer ONLY the listed question numbers based ONLY on the provided 'Source Text'.
-
-CRITICAL RULES:
-- Answer CONCISELY (1-2 sentences maximum)
-- Use ONLY information from the Source Text
-- Be direct and factual
-- If information is not found, respond exactly: "Information not found in the policy document"
-- Number your answers to match the ORIGINAL question numbers provided below
-
-Source Text:
-{context_str}
-
-Questions to Answer (use these original numbers in your answers):
-{missing_questions_text}
-
-Instructions:
-Provide your answers in this exact format using the original numbers:
-{''.join([str(i+1)+'. [Answer]\n' for i in missing_indices])}
-
-Final Answers:
-"""
+        answer_format_text = "\n".join(f"{i+1}. [Answer]" for i in missing_indices)
+        message_missing = _MISSING_QUESTIONS_TEMPLATE.format(
+            questions=missing_questions_text,
+            answer_format=answer_format_text
+        )
         try:
-            response2 = await self.model.generate_content_async(prompt_missing)
+            # Fresh session over the same seeded prefix, so a failed first turn cannot leak into the retry
+            retry_chat = self.model.start_chat(history=history)
+            response2 = await retry_chat.send_message_async(message_missing)
             response2_text = response2.text.strip()
             retry_map = self._parse_numbered_answers_map(response2_text)
             # Fill in missing only if provided
@@ -128,34 +165,49 @@ Final Answers:
         # Finalize with placeholders for anything still missing
         return [ans if ans else "Information not found in the policy document" for ans in results]
 
+    def _join_context(self, context_chunks: List[str]) -> str:
+        """
+        Joins context chunks with the section separator into a single buffer,
+        without materializing an intermediate list of pieces.
+        """
+        buffer = io.StringIO()
+        for i, chunk in enumerate(context_chunks):
+            if i:
+                buffer.write("\n\n---\n\n")
+            buffer.write(chunk)
+        return buffer.getvalue()
+
+    def _build_seed_history(self, context_str: str) -> List[Dict]:
+        """
+        Builds the chat history that carries the rules and the Source Text, shared
+        by every attempt of a request.
+        """
+        seed_prompt = "".join((_SEED_PROMPT_HEAD, context_str, "\n"))
+        return [
+            {"role": "user", "parts": [seed_prompt]},
+            {"role": "model", "parts": [_SEED_MODEL_ACK]},
+        ]
+
     def _parse_numbered_answers_map(self, response_text: str) -> Dict[int, str]:
         """
         Parses numbered answers like "1. ...", "2. ..." into a map of index->answer.
         Tolerates lines with extra whitespace. Only captures leading integer index.
         """
-        lines = response_text.split('\n')
         answers: Dict[int, str] = {}
-        for raw in lines:
+        for raw in response_text.splitlines():
             line = raw.strip()
             if not line:
                 continue
-            # Find patterns like "12. answer..."
-            if line[0].isdigit():
-                # Extract leading integer
-                num_str = ''
-                j = 0
-                while j < len(line) and line[j].isdigit():
-                    num_str += line[j]
-                    j += 1
-                # Expect a dot after number
-                if j < len(line) and line[j] == '.':
-                    try:
-                        idx = int(num_str)
-                        ans = line[j+1:].strip()
-                        if ans:
-                            answers[idx] = ans
-                    except ValueError:
-                        continue
+            # Fast path for the well-formed "N. answer" case
+            head, sep, tail = line.partition('.')
+            if sep and head.isdigit() and head.isascii():
+                answer = tail.strip()
+                if answer:
+                    answers[int(head)] = answer
+                continue
+            match = self._ANSWER_LINE_RE.match(line)
+            if match:
+                answers[int(match.group(1))] = match.group(2)
         return answers
 
     async def process_single_question_with_context(self, question: str, context_chunks: List[str]) -> str:
@@ -169,25 +221,8 @@ Final Answers:
         Returns:
             Answer to the question
         """
-        context_str = "\n\n---\n\n".join(context_chunks)
-        
-        prompt = f"""
-You are a precise and factual insurance policy assistant. Answer the following question based ONLY on the provided 'Source Text'.
-
-CRITICAL RULES:
-- Answer CONCISELY (1-2 sentences maximum)
-- Use ONLY information from the Source Text
-- Be direct and factual
-- If information is not found, respond exactly: "Information not found in the policy document"
-
-Source Text:
-{context_str}
-
-Question:
-{question}
-
-Answer:
-"""
+        context_str = self._join_context(context_chunks)
+        prompt = "".join((_SINGLE_PROMPT_HEAD, context_str, _SINGLE_PROMPT_MID, question, _SINGLE_PROMPT_TAIL))
 
         try:
             response = await self.model.generate_content_async(prompt)
@@ -0,0 +1,48 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+class LRUCache:
+    """
+    A small thread-safe, size-bounded LRU cache. Once full, the least recently
+    used entry is evicted on insert.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        """
+        Initializes an empty cache holding at most `maxsize` entries.
+        """
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """
+        Returns the cached value for `key` (marking it most recently used), or `default`.
+        """
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Stores `value` under `key`, evicting the least recently used entry if full.
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
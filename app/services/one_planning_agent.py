@@ -23,7 +23,7 @@ class PlanningAgent:
             generation_config=generation_config
         )
 
-    def plan_and_research(self, question: str) -> Dict[str, List[str]]:
+    async def plan_and_research(self, question: str) -> Dict[str, List[str]]:
         """
         Decomposes a question and generates hypothetical answers for each sub-question.
 
@@ -49,7 +49,7 @@ User Question: {safe_question}
 """
 
         try:
-            response = self.model.generate_content(prompt)
+            response = await self.model.generate_content_async(prompt)
             response_data = json.loads(response.text)
             
             # Fallback if the model fails to produce a valid structure
@@ -0,0 +1,76 @@
+import threading
+import numpy as np
+from typing import List, Optional
+
+class SemanticAnswerCache:
+    """
+    An answer cache keyed by question embedding. A lookup hits when a stored
+    question from the same context version is semantically close enough,
+    so answers are reused across requests but never across index rebuilds.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, max_entries: int = 1024):
+        """
+        Initializes an empty cache.
+
+        Args:
+            similarity_threshold: Minimum cosine similarity for a cached answer to be reused.
+            max_entries: Maximum number of cached answers; the oldest are evicted first.
+        """
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self._embeddings: List[np.ndarray] = []
+        self._questions: List[str] = []
+        self._answers: List[str] = []
+        self._version: Optional[int] = None
+        self._matrix: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def lookup_many(self, embeddings: List[np.ndarray], version: int) -> List[Optional[str]]:
+        """
+        Looks up cached answers for several question embeddings at once. All
+        entries are scored with a single matrix multiplication.
+
+        Args:
+            embeddings: One embedding per question.
+            version: The current context version of the retrieval index.
+
+        Returns:
+            The cached answer for each question, or None where there is no hit.
+        """
+        with self._lock:
+            if not embeddings or not self._answers or version != self._version:
+                return [None] * len(embeddings)
+            if self._matrix is None:
+                self._matrix = np.vstack(self._embeddings)
+            matrix = self._matrix
+            answers = list(self._answers)
+
+        scores = self._normalize(np.vstack(embeddings)) @ matrix.T
+        best = scores.argmax(axis=1)
+        return [
+            answers[j] if scores[i, j] >= self.similarity_threshold else None
+            for i, j in enumerate(best)
+        ]
+
+    def store(self, embedding: np.ndarray, question: str, answer: str, version: int):
+        """
+        Stores an answer. Entries from an older context version are dropped,
+        since they can no longer be served.
+        """
+        with self._lock:
+            if version != self._version:
+                self._embeddings, self._questions, self._answers = [], [], []
+                self._version = version
+            self._embeddings.append(self._normalize(embedding.reshape(1, -1))[0])
+            self._questions.append(question)
+            self._answers.append(answer)
+            if len(self._answers) > self.max_entries:
+                del self._embeddings[0], self._questions[0], self._answers[0]
+            self._matrix = None
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = vectors.astype(np.float32, copy=False)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
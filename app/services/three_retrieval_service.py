@@ -1,11 +1,39 @@
+import asyncio
+from collections import deque
+import hashlib
 import fitz  # PyMuPDF
 import httpx
 import time
+import numpy as np
+import orjson
+import tiktoken
+import torch
 from pinecone import Pinecone, ServerlessSpec
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from sentence_transformers import SentenceTransformer, CrossEncoder
-from typing import List
+from typing import BinaryIO, Iterator, List, Optional, Tuple, Union
 from app.core.config import settings
+from app.services.lru_cache import LRUCache
+
+# A retrieved chunk: (match_id, text, token count recorded at ingest or None)
+RetrievedChunk = Tuple[str, str, Optional[int]]
+
+def open_pdf(source: Union[str, bytes]) -> fitz.Document:
+    """
+    Opens a PDF from a local file path or directly from its bytes.
+    """
+    if isinstance(source, str):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype="pdf")
+
+def extract_pdf_text(source: Union[str, bytes], start_page: int = 0, end_page: Optional[int] = None) -> str:
+    """
+    Extracts the text of pages [start_page, end_page) of a PDF given as a path or
+    bytes. Kept at module level so page ranges can be parsed in worker processes.
+    """
+    with open_pdf(source) as doc:
+        end = doc.page_count if end_page is None else min(end_page, doc.page_count)
+        # Collect page texts and join once instead of repeated string concatenation
+        return "".join([doc[i].get_text("text", sort=False) for i in range(start_page, end)])
 
 class RetrievalService:
     """
@@ -15,6 +43,17 @@ class RetrievalService:
     
     INDEX_NAME = "hackathon-rag-index"
     EMBEDDING_DIMENSION = 384 # Based on the 'all-MiniLM-L6-v2' model
+    QUERY_CACHE_SIZE = 1024 # Max number of query embeddings kept in the LRU cache
+    CHUNK_EMBEDDING_CACHE_SIZE = 8192 # Max number of chunk embeddings kept in the LRU cache (~1.5 KB each)
+    CHUNK_SIZE_TOKENS = 512
+    CHUNK_OVERLAP_TOKENS = 76 # Overlap in tokens (15% of 512)
+    INGEST_BATCH_SIZE = 64 # Chunks embedded and upserted per batch during ingestion
+    UPSERT_POOL_THREADS = 4 # Concurrent async upsert requests to Pinecone
+    RERANK_BATCH_SIZE = 128 # (query, chunk) pairs per CrossEncoder forward batch
+    PINECONE_API_VERSION = "2024-07" # Data-plane REST API version used for queries
+    # The source-PDF hash is stored on a single vector in its own namespace, so it never shows up in searches
+    META_NAMESPACE = "__meta__"
+    META_VECTOR_ID = "__meta__"
 
     def __init__(self, embedding_model_name: str = 'all-MiniLM-L6-v2', reranker_model_name: str = 'cross-encoder/ms-marco-MiniLM-L-6-v2'):
         """
@@ -23,63 +62,170 @@ class RetrievalService:
         print("Initializing RetrievalService with Pinecone...")
         self.embedding_model = SentenceTransformer(embedding_model_name)
         self.reranker_model = CrossEncoder(reranker_model_name)
+        if settings.QUANTIZE_RETRIEVAL_MODELS:
+            self._reduce_model_precision()
 
-        self.text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-            model_name="gpt-4",
-            chunk_size=512,
-            chunk_overlap=76  # Overlap in tokens (15% of 512)
-        )
+        # Tokenizer used to chunk documents by token count
+        self.tokenizer = tiktoken.encoding_for_model("gpt-4")
         
         # Initialize Pinecone client
         self.pinecone = Pinecone(api_key=settings.PINECONE_API_KEY)
         self.index = None
+        # Data-plane host of the index and the shared async HTTP/2 client used to query it
+        self.index_host = None
+        self._http_client = None
         self.text_chunks: List[str] = []
+        # Bumped on every index rebuild so version-tagged caches can detect stale entries
+        self.context_version = 0
+
+        # LRU cache of query -> embedding, shared by all retrieval calls
+        self._query_embedding_cache = LRUCache(maxsize=self.QUERY_CACHE_SIZE)
+        # Chunk embeddings keyed by content hash, reused when a document is re-ingested
+        self._chunk_embedding_cache = LRUCache(maxsize=self.CHUNK_EMBEDDING_CACHE_SIZE)
 
         # Attach to existing index if present to avoid reingestion
+        self.attach_existing_index()
+
+        print("RetrievalService initialized successfully.")
+
+    def attach_existing_index(self) -> bool:
+        """
+        Attaches to the Pinecone index if it exists, e.g. after another process has
+        (re)built it. Bumps context_version, since the index contents may have changed.
+        Returns False, leaving the service without an index, if it does not exist.
+        """
         try:
             existing_indexes = self.pinecone.list_indexes().names()
-            if self.INDEX_NAME in existing_indexes:
-                self.index = self.pinecone.Index(self.INDEX_NAME)
-                print(f"Using existing Pinecone index: {self.INDEX_NAME}")
-            else:
+            if self.INDEX_NAME not in existing_indexes:
                 print(f"Pinecone index '{self.INDEX_NAME}' not found. You may need to preload it.")
+                self.index = None
+                self.index_host = None
+                return False
+            self.index = self.pinecone.Index(self.INDEX_NAME)
+            self.index_host = self.pinecone.describe_index(self.INDEX_NAME).host
+            self.context_version += 1
+            print(f"Using existing Pinecone index: {self.INDEX_NAME}")
+            return True
         except Exception as e:
             print(f"Warning: Could not inspect Pinecone indexes: {e}")
+            return False
 
-        print("RetrievalService initialized successfully.")
+    def warm_up(self):
+        """
+        Runs one dummy embedding and rerank pass so torch's first-call kernel setup
+        and device allocations happen before the first real request.
+        """
+        self.embedding_model.encode(["warmup"], convert_to_numpy=True)
+        self.reranker_model.predict([["warmup", "warmup"]])
+        print("Retrieval models warmed up.")
+
+    def _reduce_model_precision(self):
+        """
+        Runs the MiniLM embedding and reranking models at reduced precision:
+        FP16 on GPU, dynamic int8 quantization of the Linear layers on CPU.
+        """
+        try:
+            if torch.cuda.is_available():
+                self.embedding_model.half().to("cuda")
+                self.reranker_model.model.half().to("cuda")
+                print("Retrieval models converted to FP16 on GPU.")
+            else:
+                self.embedding_model = torch.quantization.quantize_dynamic(
+                    self.embedding_model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+                self.reranker_model.model = torch.quantization.quantize_dynamic(
+                    self.reranker_model.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+                print("Retrieval models quantized to int8 on CPU.")
+        except Exception as e:
+            print(f"Warning: Could not reduce retrieval model precision, using FP32: {e}")
 
     def ingest_and_process_pdf(self, pdf_path: str):
         """
-        Reads a PDF from a local file path only, extracts text, chunks it,
-        and upserts the embeddings into a new Pinecone index.
+        Reads a PDF from a local file path and ingests it. Thin wrapper around
+        ingest_and_process_pdf_bytes.
         """
         print(f"Ingesting PDF from local path: {pdf_path}")
-        
-        # Only handle local file paths for now
         try:
-            full_text = ""
-            with fitz.open(pdf_path) as doc:
-                for page in doc:
-                    full_text += page.get_text()
+            with open(pdf_path, "rb") as f:
+                data = f.read()
         except Exception as e:
             raise ValueError(f"Could not read or process PDF from path: {pdf_path}. Error: {e}")
+        self.ingest_and_process_pdf_bytes(data)
 
-        self.text_chunks = self.text_splitter.split_text(full_text)
+    def ingest_and_process_pdf_bytes(self, data: Union[bytes, BinaryIO]):
+        """
+        Extracts text from an in-memory PDF (bytes or a binary file object), chunks it,
+        and upserts the embeddings into a new Pinecone index. No filesystem path is needed.
+        """
+        if not isinstance(data, bytes):
+            data = data.read()
+
+        pdf_hash = self.compute_bytes_hash(data)
+        full_text = self.parse_pdf(data)
+        self.ingest_text(full_text, pdf_hash)
+
+    def ingest_text(self, full_text: str, pdf_hash: str):
+        """
+        Chunks already-extracted document text and upserts the embeddings into a new
+        Pinecone index, recording pdf_hash as the source document's content hash.
+        Shared by every ingest path, so they all build the index the same way.
+        """
+        # 1. Chunk the document
+        self.text_chunks, token_counts = self.chunk_text_with_token_counts(full_text)
         print(f"Split text into {len(self.text_chunks)} chunks.")
 
-        # 2. Create Vector Embeddings
-        print("Creating embeddings for text chunks...")
-        chunk_embeddings = self.embedding_model.encode(
-            self.text_chunks, 
-            show_progress_bar=True
-        )
+        # 2. Setup Pinecone Index
+        self.prepare_index()
+
+        # 3. Create embeddings and upsert them batch by batch. Upserts are sent with
+        # async_req=True, so batch i uploads while batch i+1 is being embedded. At most
+        # UPSERT_POOL_THREADS uploads are kept in flight: once more are pending, the
+        # oldest is awaited, so payloads cannot pile up when embedding outpaces Pinecone.
+        print("Creating embeddings and upserting vectors to Pinecone...")
+        upsert_requests = deque()
+        for vectors in self._iter_vector_batches(self.text_chunks, token_counts):
+            upsert_requests.append(self.index.upsert(vectors=vectors, async_req=True))
+            if len(upsert_requests) > self.UPSERT_POOL_THREADS:
+                upsert_requests.popleft().get()
+
+        # Wait for the remaining upserts; .get() re-raises any upload error
+        while upsert_requests:
+            upsert_requests.popleft().get()
+        print(f"Successfully upserted {len(self.text_chunks)} vectors to Pinecone.")
 
-        # 3. Setup Pinecone Index
+        # 4. Record which PDF the index was built from
+        self.store_indexed_pdf_hash(pdf_hash)
+
+    def parse_pdf(self, source: Union[str, bytes]) -> str:
+        """
+        Extracts the full text of a PDF given as a local path or bytes.
+        """
+        try:
+            return extract_pdf_text(source)
+        except Exception as e:
+            origin = f"path: {source}" if isinstance(source, str) else "bytes"
+            raise ValueError(f"Could not read or process PDF from {origin}. Error: {e}")
+
+    @staticmethod
+    def count_pdf_pages(source: Union[str, bytes]) -> int:
+        """
+        Returns the number of pages in a PDF given as a local path or bytes.
+        """
+        with open_pdf(source) as doc:
+            return doc.page_count
+
+    def prepare_index(self):
+        """
+        Recreates the Pinecone index from scratch, waits until it is ready and
+        attaches to it. Bumps context_version, invalidating version-tagged caches.
+        """
         print("Setting up Pinecone index...")
         if self.INDEX_NAME in self.pinecone.list_indexes().names():
             print(f"Deleting existing index: {self.INDEX_NAME}")
             self.pinecone.delete_index(self.INDEX_NAME)
         
+        self.context_version += 1
         print(f"Creating new index: {self.INDEX_NAME}")
         self.pinecone.create_index(
             name=self.INDEX_NAME,
@@ -88,53 +234,353 @@ class RetrievalService:
             spec=ServerlessSpec(cloud="aws", region="us-east-1")
         )
         
-        while not self.pinecone.describe_index(self.INDEX_NAME).status['ready']:
-            time.sleep(1)
+        self._wait_for_index_ready()
 
-        self.index = self.pinecone.Index(self.INDEX_NAME)
+        self.index = self.pinecone.Index(self.INDEX_NAME, pool_threads=self.UPSERT_POOL_THREADS)
+        self.index_host = self.pinecone.describe_index(self.INDEX_NAME).host
         print("Pinecone index is ready.")
 
-        # 4. Upsert vectors into Pinecone
-        print("Upserting vectors to Pinecone...")
-        vectors_to_upsert = []
-        for i, (chunk, embedding) in enumerate(zip(self.text_chunks, chunk_embeddings)):
-            vectors_to_upsert.append({
-                "id": str(i),
+    def embed_batch(self, chunks: List[str], start_id: int, token_counts: Optional[List[int]] = None) -> List[dict]:
+        """
+        Embeds a batch of chunks and returns their Pinecone upsert payloads, with
+        ids numbered from start_id. Each chunk's token count is stored in its
+        metadata so query-time context budgeting needs no token-counting call;
+        counts are computed here if not supplied by the chunker.
+        """
+        embeddings = self.embed_documents(chunks)
+        if token_counts is None:
+            token_counts = [len(self.tokenizer.encode(chunk)) for chunk in chunks]
+        return [
+            {
+                "id": str(start_id + i),
                 "values": embedding.tolist(),
-                "metadata": {"text": chunk}
-            })
-        
-        self.index.upsert(vectors=vectors_to_upsert, batch_size=100)
-        print(f"Successfully upserted {len(vectors_to_upsert)} vectors to Pinecone.")
+                "metadata": {"text": chunk, "tokens": tokens}
+            }
+            for i, (chunk, embedding, tokens) in enumerate(zip(chunks, embeddings, token_counts))
+        ]
+
+    @staticmethod
+    def compute_file_hash(path: str) -> str:
+        """
+        Returns the blake2b content hash of a file, read in 1 MiB blocks.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
 
+    @staticmethod
+    def compute_bytes_hash(data: bytes) -> str:
+        """
+        Returns the blake2b content hash of in-memory PDF bytes; matches compute_file_hash.
+        """
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
 
-    def search_and_rerank(self, query: str, top_k_retrieval: int = 20, top_n_rerank: int = 5) -> List[str]:
+    def get_indexed_pdf_hash(self) -> Optional[str]:
         """
-        Performs a two-stage search using Pinecone for retrieval and a CrossEncoder for reranking.
+        Returns the hash of the PDF the current index was built from, or None if the
+        index carries no such record (e.g. it predates hash tracking).
         """
         if not self.index:
-            raise RuntimeError("Document has not been ingested. Call ingest_and_process_pdf() first or preload the index.")
+            return None
+        response = self.index.fetch(ids=[self.META_VECTOR_ID], namespace=self.META_NAMESPACE)
+        meta_vector = response.vectors.get(self.META_VECTOR_ID)
+        if meta_vector is None or not meta_vector.metadata:
+            return None
+        return meta_vector.metadata.get("pdf_hash")
 
-        query_embedding = self.embedding_model.encode([query]).tolist()
-        
-        query_response = self.index.query(
-            vector=query_embedding,
-            top_k=top_k_retrieval,
-            include_metadata=True
+    def store_indexed_pdf_hash(self, pdf_hash: str):
+        """
+        Upserts the metadata vector holding the source PDF hash. Pinecone rejects
+        all-zero dense vectors, so a unit basis vector is used as the placeholder.
+        """
+        placeholder = [0.0] * self.EMBEDDING_DIMENSION
+        placeholder[0] = 1.0
+        self.index.upsert(
+            vectors=[{"id": self.META_VECTOR_ID, "values": placeholder, "metadata": {"pdf_hash": pdf_hash}}],
+            namespace=self.META_NAMESPACE
         )
-        
-        if not query_response['matches']:
-            print("Warning: No relevant chunks found in Pinecone for the query.")
+
+
+    def chunk_text_with_token_counts(self, text: str) -> Tuple[List[str], List[int]]:
+        """
+        Splits text into overlapping chunks of CHUNK_SIZE_TOKENS tokens. The document
+        is tokenized once and chunks are decoded from token-id slices, so nothing is
+        re-tokenized during splitting; each chunk's token count is its slice length.
+        Slice boundaries are moved back to whole characters, so a multi-byte character
+        is never split (which would decode to U+FFFD at the chunk edges).
+        """
+        token_ids = self.tokenizer.encode(text)
+        step = self.CHUNK_SIZE_TOKENS - self.CHUNK_OVERLAP_TOKENS
+        chunks = []
+        token_counts = []
+        for nominal_start in range(0, len(token_ids), step):
+            nominal_end = nominal_start + self.CHUNK_SIZE_TOKENS
+            start = self._align_to_char_boundary(token_ids, nominal_start)
+            end = self._align_to_char_boundary(token_ids, nominal_end)
+            if end <= start:
+                end = nominal_end
+            chunk_ids = token_ids[start:end]
+            chunk = self.tokenizer.decode(chunk_ids).strip()
+            if chunk:
+                chunks.append(chunk)
+                token_counts.append(len(chunk_ids))
+            if nominal_end >= len(token_ids):
+                break
+        return chunks, token_counts
+
+    def _align_to_char_boundary(self, token_ids: List[int], index: int) -> int:
+        """
+        Moves a token index back while the token at it starts with a UTF-8
+        continuation byte, i.e. while the index falls inside a multi-byte character.
+        """
+        while 0 < index < len(token_ids) and self.tokenizer.decode_single_token_bytes(token_ids[index])[0] & 0xC0 == 0x80:
+            index -= 1
+        return index
+
+    def _wait_for_index_ready(self, max_delay: float = 2.0, timeout: float = 300.0):
+        """
+        Polls Pinecone until the index reports ready, backing off exponentially from
+        100ms up to max_delay. Transient describe_index failures are retried rather
+        than aborting the ingest.
+        """
+        delay = 0.1
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if self.pinecone.describe_index(self.INDEX_NAME).status['ready']:
+                    return
+            except Exception as e:
+                print(f"Warning: Could not describe Pinecone index, retrying: {e}")
+            if time.monotonic() + delay > deadline:
+                raise RuntimeError(f"Pinecone index '{self.INDEX_NAME}' was not ready after {timeout:.0f}s.")
+            time.sleep(delay)
+            delay = min(delay * 1.5, max_delay)
+
+    def _iter_vector_batches(self, chunks: List[str], token_counts: List[int]) -> Iterator[List[dict]]:
+        """
+        Lazily embeds chunks and yields Pinecone upsert payloads one batch at a time,
+        so vector dicts are only materialized for batches the caller has requested.
+        """
+        for start in range(0, len(chunks), self.INGEST_BATCH_SIZE):
+            end = start + self.INGEST_BATCH_SIZE
+            yield self.embed_batch(chunks[start:end], start, token_counts[start:end])
+
+    def embed_documents(self, texts: List[str], batch_size: int = 32) -> List[np.ndarray]:
+        """
+        Embeds document chunks, serving previously seen chunks from an LRU cache keyed
+        by the blake2b hash of their content. Only the cache misses are encoded, in a
+        single batch, and spliced back in input order.
+        """
+        keys = [hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest() for text in texts]
+        embeddings = [self._chunk_embedding_cache.get(key) for key in keys]
+
+        miss_indices = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if miss_indices:
+            new_embeddings = self.embedding_model.encode(
+                [texts[i] for i in miss_indices], batch_size=batch_size, convert_to_numpy=True
+            ).astype(np.float32, copy=False)
+            for i, embedding in zip(miss_indices, new_embeddings):
+                self._chunk_embedding_cache.set(keys[i], embedding)
+                embeddings[i] = embedding
+
+        return embeddings
+
+    def encode_queries(self, queries: List[str], batch_size: int = 32) -> List[np.ndarray]:
+        """
+        Encodes queries into embeddings, serving repeated queries from an LRU cache
+        and encoding all cache misses together in a single batch.
+
+        Args:
+            queries: The query strings to encode.
+            batch_size: Batch size used when encoding the cache misses.
+
+        Returns:
+            One embedding per query (same order).
+        """
+        embeddings = {}
+        for query in queries:
+            embedding = self._query_embedding_cache.get(query)
+            if embedding is not None:
+                embeddings[query] = embedding
+
+        misses = [query for query in dict.fromkeys(queries) if query not in embeddings]
+        if misses:
+            new_embeddings = self.embedding_model.encode(misses, batch_size=batch_size, convert_to_numpy=True).astype(np.float32, copy=False)
+            for query, embedding in zip(misses, new_embeddings):
+                self._query_embedding_cache.set(query, embedding)
+                embeddings[query] = embedding
+
+        return [embeddings[query] for query in queries]
+
+    async def search_and_rerank_batch(self, queries: List[str], top_k_retrieval: int = 20, top_n_rerank: int = 5) -> List[List[RetrievedChunk]]:
+        """
+        Two-stage search: Pinecone retrieval, then CrossEncoder reranking. Encodes all
+        queries in one pass, issues the Pinecone queries concurrently and scores every
+        (query, chunk) pair with a single CrossEncoder call. Chunks are returned as
+        (match_id, text, tokens) triples so callers can deduplicate on the short
+        Pinecone id and budget context without recounting tokens.
+
+        Args:
+            queries: The queries to retrieve context for.
+            top_k_retrieval: Number of candidates fetched from Pinecone per query.
+            top_n_rerank: Number of chunks kept per query after reranking.
+
+        Returns:
+            A list of reranked (match_id, text, tokens) lists, one per query (same order).
+        """
+        if not self.index:
+            raise RuntimeError("Document has not been ingested. Call ingest_and_process_pdf() first or preload the index.")
+
+        if not queries:
             return []
 
-        retrieved_chunks = [match['metadata']['text'] for match in query_response['matches']]
+        candidates = await self._retrieve_candidates(queries, top_k_retrieval)
+        if not any(candidates):
+            print("Warning: No relevant chunks found in Pinecone for the queries.")
+            return [[] for _ in queries]
 
-        rerank_pairs = [[query, chunk] for chunk in retrieved_chunks]
-        scores = self.reranker_model.predict(rerank_pairs)
-        
-        scored_chunks = list(zip(scores, retrieved_chunks))
-        scored_chunks.sort(key=lambda x: x[0], reverse=True)
-        
-        reranked_chunks = [chunk for score, chunk in scored_chunks[:top_n_rerank]]
-        
-        return reranked_chunks
+        return await asyncio.to_thread(self.rerank_many, queries, candidates, top_n_rerank)
+
+    async def search_and_rerank_merged(self, rerank_query: str, search_queries: List[str], top_k_retrieval: int = 20, top_n_rerank: int = 5) -> List[RetrievedChunk]:
+        """
+        Retrieves candidates for several search queries (e.g. hypothetical answers) in
+        one batched round, merges them by match id and reranks the union against a
+        single query with one CrossEncoder call.
+
+        Args:
+            rerank_query: The query the merged candidates are scored against.
+            search_queries: The queries used for vector search.
+            top_k_retrieval: Number of candidates fetched from Pinecone per search query.
+            top_n_rerank: Number of chunks kept after reranking.
+
+        Returns:
+            The reranked (match_id, text, tokens) triples.
+        """
+        if not self.index:
+            raise RuntimeError("Document has not been ingested. Call ingest_and_process_pdf() first or preload the index.")
+
+        if not search_queries:
+            return []
+
+        candidates = await self._retrieve_candidates(search_queries, top_k_retrieval)
+        merged = list({chunk[0]: chunk for chunks in candidates for chunk in chunks}.values())
+        if not merged:
+            print("Warning: No relevant chunks found in Pinecone for the queries.")
+            return []
+
+        reranked = await asyncio.to_thread(self.rerank_many, [rerank_query], [merged], top_n_rerank)
+        return reranked[0]
+
+    def rerank_many(self, queries: List[str], candidates_per_query: List[List[RetrievedChunk]], top_n_rerank: int = 5) -> List[List[RetrievedChunk]]:
+        """
+        Reranks several candidate groups in a single CrossEncoder forward pass. All
+        (query, chunk) pairs are flattened into one batch, then the scores are
+        scattered back and each group is cut to its top-N.
+
+        Args:
+            queries: One query per candidate group.
+            candidates_per_query: The (match_id, text, tokens) candidates for each query.
+            top_n_rerank: Number of chunks kept per group.
+
+        Returns:
+            The reranked (match_id, text, tokens) lists, one per query (same order).
+        """
+        rerank_pairs = [[query, chunk[1]] for query, chunks in zip(queries, candidates_per_query) for chunk in chunks]
+        if not rerank_pairs:
+            return [[] for _ in queries]
+
+        scores = self.reranker_model.predict(rerank_pairs, batch_size=self.RERANK_BATCH_SIZE)
+
+        reranked: List[List[RetrievedChunk]] = []
+        offset = 0
+        for chunks in candidates_per_query:
+            scored_chunks = list(zip(scores[offset:offset + len(chunks)], chunks))
+            scored_chunks.sort(key=lambda x: x[0], reverse=True)
+            offset += len(chunks)
+            reranked.append([chunk for score, chunk in scored_chunks[:top_n_rerank]])
+
+        return reranked
+
+    async def _retrieve_candidates(self, queries: List[str], top_k_retrieval: int) -> List[List[RetrievedChunk]]:
+        """
+        Encodes all queries in one pass and issues their Pinecone queries concurrently.
+        Returns the unique (match_id, text, tokens) candidates per query; a failed query yields [].
+        """
+        query_embeddings = await asyncio.to_thread(self.encode_queries, queries)
+
+        query_responses = await asyncio.gather(*[
+            self._query_index(embedding, top_k_retrieval)
+            for embedding in query_embeddings
+        ], return_exceptions=True)
+
+        candidates: List[List[RetrievedChunk]] = []
+        for query, query_response in zip(queries, query_responses):
+            if isinstance(query_response, Exception):
+                print(f"Warning: Could not get context for query '{query}': {query_response}")
+                candidates.append([])
+                continue
+            # Drop duplicate matches by id so each (query, chunk) pair is scored only once
+            unique_matches = {match['id']: self._match_to_chunk(match) for match in query_response['matches']}
+            candidates.append(list(unique_matches.values()))
+
+        return candidates
+
+    @staticmethod
+    def _match_to_chunk(match: dict) -> RetrievedChunk:
+        """
+        Converts a Pinecone match into a (match_id, text, tokens) triple. Pinecone returns
+        numeric metadata as floats; vectors ingested without a count yield None.
+        """
+        metadata = match['metadata']
+        tokens = metadata.get('tokens')
+        return (match['id'], metadata['text'], int(tokens) if tokens is not None else None)
+
+    async def _query_index(self, vector: np.ndarray, top_k: int) -> dict:
+        """
+        Queries the index over Pinecone's REST API with the shared async HTTP/2 client,
+        so concurrent queries are multiplexed without a worker thread per call.
+        Falls back to the SDK client when the index host is unknown.
+        """
+        if not self.index_host:
+            return await asyncio.to_thread(self.index.query, vector=vector.tolist(), top_k=top_k, include_metadata=True)
+
+        # orjson serializes the float32 array directly, without a Python float list
+        body = orjson.dumps(
+            {"vector": vector, "topK": top_k, "includeMetadata": True},
+            option=orjson.OPT_SERIALIZE_NUMPY
+        )
+        response = await self._get_http_client().post(
+            "/query",
+            content=body,
+            headers={"Content-Type": "application/json"}
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """
+        Lazily creates the keep-alive HTTP/2 client for the current index host.
+        """
+        base_url = f"https://{self.index_host}"
+        if self._http_client is None or self._http_client.is_closed or str(self._http_client.base_url).rstrip("/") != base_url:
+            self._http_client = httpx.AsyncClient(
+                base_url=base_url,
+                headers={
+                    "Api-Key": settings.PINECONE_API_KEY,
+                    "X-Pinecone-API-Version": self.PINECONE_API_VERSION
+                },
+                http2=True,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+                timeout=30.0
+            )
+        return self._http_client
+
+    async def aclose(self):
+        """
+        Closes the shared HTTP client.
+        """
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
@@ -1,22 +1,265 @@
+import asyncio
+import hashlib
+import json
 import google.generativeai as genai
-from typing import List, AsyncGenerator
+from functools import lru_cache
+from typing import List, AsyncGenerator, Optional
 from app.core.config import settings
+from app.services.lru_cache import LRUCache
 
-# Configure the Gemini client with your API key
-genai.configure(api_key=settings.GOOGLE_API_KEY)
+MODEL_NAME = "models/gemini-2.5-flash-preview-05-20"
+# Cheaper, faster model for trivial questions over a small context
+LITE_MODEL_NAME = "models/gemini-2.5-flash-lite"
+
+# Static Chain-of-Thought instructions, token-compressed (no markdown emphasis, no
+# parentheticals, filler words dropped). They are set once as the models' system
+# instruction; only the Source Text and question are built per call.
+SYSTEM_INSTRUCTION = """
+Precise, factual writing assistant. Answer the user's question as concisely as possible, using ONLY the Source Text.
+Follow this chain of thought internally; never output it. Output only the answer text.
+1. Synthesize: find the most direct, relevant Source Text information for the question.
+2. Critique: is this the shortest accurate, complete answer? Cut unnecessary details, examples, lists.
+3. Refine: rewrite as one or two clear sentences summarizing the key information.
+Rules: be brief, no multi-paragraph explanations. Summarize, don't list every detail. Answer directly.
+"""
+
+# Static fragments of the per-question prompt tail, concatenated around the
+# Source Text and question instead of re-formatting an f-string on every call
+_PROMPT_HEAD = "\n---\nSource Text:\n"
+_PROMPT_MID = "\n---\nUser's Original Question:\n\""
+_PROMPT_TAIL = "\"\n---\nFinal, Concise Answer:\n"
+# Tail for JSON-constrained answers; the response schema replaces the answer trailer
+_PROMPT_JSON_TAIL = "\"\n"
+# Fragments of the batched prompt, which answers several questions over one Source Text
+_BATCH_PROMPT_MID = "\n---\nUser's Original Questions:\n"
+_BATCH_PROMPT_TAIL = (
+    "\n---\nAnswer each question independently, following your instructions. "
+    "Respond with a JSON object of the form "
+    "{\"answers\": [\"answer to question 1\", \"answer to question 2\", ...]} "
+    "containing exactly one answer per question, in question order.\n"
+)
+
+# Output cap per answer. Gemini 2.5 counts internal thinking tokens against it, so it
+# leaves headroom above the one or two sentences the instructions ask for
+MAX_ANSWER_TOKENS = 512
+# Larger but still fixed cap for the single retry of an answer cut off by MAX_ANSWER_TOKENS
+FALLBACK_MAX_ANSWER_TOKENS = 2 * MAX_ANSWER_TOKENS
+ANSWER_TEMPERATURE = 0.2
+
+# Plain-text answers, used when streaming to a client
+_STREAM_GENERATION_CONFIG = genai.GenerationConfig(
+    max_output_tokens=MAX_ANSWER_TOKENS,
+    temperature=ANSWER_TEMPERATURE,
+    candidate_count=1
+)
+
+# Retry for answers the capped JSON call could not deliver (e.g. cut off by the cap)
+_FALLBACK_GENERATION_CONFIG = genai.GenerationConfig(
+    max_output_tokens=FALLBACK_MAX_ANSWER_TOKENS,
+    temperature=ANSWER_TEMPERATURE,
+    candidate_count=1
+)
+
+# Constrains single answers to {"answer": "..."} so no preamble tokens are generated
+_ANSWER_GENERATION_CONFIG = genai.GenerationConfig(
+    max_output_tokens=MAX_ANSWER_TOKENS,
+    temperature=ANSWER_TEMPERATURE,
+    candidate_count=1,
+    response_mime_type="application/json",
+    response_schema=genai.protos.Schema(
+        type=genai.protos.Type.OBJECT,
+        properties={"answer": genai.protos.Schema(type=genai.protos.Type.STRING)},
+        required=["answer"]
+    )
+)
+
+@lru_cache(maxsize=1)
+def _configure_client():
+    """
+    Configures the Gemini client with your API key, exactly once per process.
+    """
+    genai.configure(api_key=settings.GOOGLE_API_KEY)
+
+class _GeminiModel:
+    """
+    A Gemini model carrying SYSTEM_INSTRUCTION as its system instruction, plus a
+    plain model for token counting.
+
+    Explicit context caching is not used: the compressed instructions are far below
+    Gemini's minimum cacheable size, so creating a cache would always fail.
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME):
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name, system_instruction=SYSTEM_INSTRUCTION)
+        # Plain model for count_tokens, so counts exclude the instructions
+        self.token_counter = genai.GenerativeModel(model_name)
+
+@lru_cache(maxsize=None)
+def _get_model(model_name: str = MODEL_NAME) -> _GeminiModel:
+    """
+    Returns the process-wide model for model_name, so all agents share one client
+    and its keep-alive connection pool.
+    """
+    _configure_client()
+    return _GeminiModel(model_name)
+
+# Gemini token counts per chunk, keyed by the chunk's content hash
+_TOKEN_COUNT_CACHE = LRUCache(maxsize=4096)
+
+async def _count_tokens(chunk: str) -> int:
+    """
+    Returns the Gemini token count of a chunk, cached by content hash. Falls back to a
+    ~4 characters/token estimate (not cached) if the count_tokens call fails.
+    """
+    key = hashlib.blake2b(chunk.encode(), digest_size=16).digest()
+    tokens = _TOKEN_COUNT_CACHE.get(key)
+    if tokens is None:
+        try:
+            response = await _get_model().token_counter.count_tokens_async(chunk)
+            tokens = response.total_tokens
+            _TOKEN_COUNT_CACHE.set(key, tokens)
+        except Exception as e:
+            print(f"Warning: Could not count tokens, estimating: {e}")
+            tokens = len(chunk) // 4
+    return tokens
+
+@lru_cache(maxsize=128)
+def _join_context(context_chunks: tuple) -> str:
+    """
+    Joins context chunks into the Source Text. Memoized, since consecutive questions
+    over the same policy often retrieve identical chunk sets.
+    """
+    return "\n\n---\n\n".join(context_chunks)
+
+class _BatchRunner:
+    """
+    Micro-batches concurrent synthesis requests. Requests already queued together
+    (plus any arriving within a short window after them) are grouped by their Source
+    Text, and each group with more than one question is answered by a single Gemini
+    call. A request that arrives alone is dispatched without waiting.
+    """
+    def __init__(self, agent: "SynthesisAgent", max_batch: int = 8, max_wait_ms: float = 20):
+        self._agent = agent
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = None
+        self._task = None
+        self._loop = None
+        # asyncio only keeps weak references to tasks; hold in-flight dispatches here
+        self._dispatch_tasks = set()
+
+    async def submit(self, question: str, context_str: str, model_name: str = MODEL_NAME) -> str:
+        """
+        Queues a question for the given model and waits for its answer.
+        """
+        self._ensure_started()
+        future = self._loop.create_future()
+        await self._queue.put((question, context_str, model_name, future))
+        return await future
+
+    def _ensure_started(self):
+        # The queue and runner task are bound to the event loop they are first used on
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            # Only wait out the window when requests are already arriving together;
+            # a lone request is dispatched right away
+            if len(batch) > 1:
+                deadline = self._loop.time() + self.max_wait
+                while len(batch) < self.max_batch:
+                    timeout = deadline - self._loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+
+            groups = {}
+            for question, context_str, model_name, future in batch:
+                groups.setdefault((model_name, context_str), []).append((question, future))
+            for (model_name, context_str), items in groups.items():
+                task = self._loop.create_task(self._dispatch(model_name, context_str, items))
+                self._dispatch_tasks.add(task)
+                task.add_done_callback(self._dispatch_tasks.discard)
+
+    async def _dispatch(self, model_name: str, context_str: str, items: list):
+        questions = [question for question, _ in items]
+        if len(items) > 1:
+            try:
+                answers = await self._agent._generate_batch(questions, context_str, model_name)
+                for (_, future), answer in zip(items, answers):
+                    if not future.done():
+                        future.set_result(answer)
+                return
+            except Exception as e:
+                print(f"Warning: Batched synthesis failed, answering individually: {e}")
+
+        results = await asyncio.gather(
+            *[self._agent._generate_single(question, context_str, model_name) for question in questions],
+            return_exceptions=True
+        )
+        for (_, future), result in zip(items, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
 
 class SynthesisAgent:
     """
     An advanced agent that uses a Chain of Thought process to synthesize, critique,
     and refine an answer in a single, streaming API call, optimized for brevity.
     """
-    def __init__(self):
+    # One batcher shared by every instance, so agents created per request still coalesce
+    _batcher = None
+    # Answers keyed by (normalized question, hash of the context chunks), shared by every instance
+    _answer_cache = LRUCache(maxsize=1024)
+    # Questions at most this long over at most this many chunks go to the lite model
+    ROUTER_MAX_WORDS = 20
+    ROUTER_MAX_CHUNKS = 2
+
+    def __init__(self, max_context_tokens: int = 8192):
+        """
+        Initializes the SynthesisAgent. The Gemini models (full and lite) are
+        process-wide singletons shared by all instances.
+
+        Args:
+            max_context_tokens: Token budget for the Source Text sent with each question.
+        """
+        self.max_context_tokens = max_context_tokens
+        # Build every routed model here, off the request path
+        for model_name in (MODEL_NAME, LITE_MODEL_NAME):
+            _get_model(model_name)
+        if SynthesisAgent._batcher is None:
+            SynthesisAgent._batcher = _BatchRunner(self)
+
+    @property
+    def model(self) -> genai.GenerativeModel:
+        return _get_model().model
+
+    async def warm_up(self):
         """
-        Initializes the SynthesisAgent, setting up the Gemini model for text generation.
+        Opens the connection to the Gemini endpoint with a count_tokens call, which
+        generates no output tokens, so the first real answer does not pay the
+        connection setup.
         """
-        self.model = genai.GenerativeModel("gemini-2.5-flash-preview-05-20")
+        try:
+            await _get_model().token_counter.count_tokens_async("ping")
+        except Exception as e:
+            print(f"Warning: Gemini warmup failed: {e}")
 
-    async def synthesize_final_answer(self, original_question: str, context_chunks: List[str]) -> str:
+    async def synthesize_final_answer(self, original_question: str, context_chunks: List[str], token_counts: Optional[List[Optional[int]]] = None) -> str:
         """
         Generates a final, high-quality, and CONCISE answer by performing an internal
         synthesis, critique, and refinement process, then returns the complete answer.
@@ -24,89 +267,170 @@ class SynthesisAgent:
         Args:
             original_question: The user's original, complete question.
             context_chunks: A list of relevant text chunks from the document.
+            token_counts: Optional per-chunk token counts recorded at ingest; chunks
+                          without one are counted with the Gemini API.
 
         Returns:
             The complete, refined answer text.
         """
-        context_str = "\n\n---\n\n".join(context_chunks)
-        
-        prompt = f"""
-You are a precise and factual writing assistant. Your primary goal is to answer the user's question as CONCISELY as possible based ONLY on the provided 'Source Text'.
-
-Follow this internal Chain of Thought, but DO NOT output the thought process. Your final output should only be the answer text.
-
-1.  **Synthesize**: First, find the most direct and relevant information in the 'Source Text' to answer the 'User's Original Question'.
-2.  **Critique for Brevity**: Second, critically review your answer. Ask yourself: "Is this the shortest possible answer that is still accurate and complete? Have I included unnecessary details, examples, or lists? Can I say this in fewer words?"
-3.  **Refine for Conciseness**: Finally, rewrite the answer to be as brief and to-the-point as possible. Summarize the key information into a single, clear sentence or two.
-
-**CRITICAL RULES:**
--   **BE BRIEF**: Do not provide long, multi-paragraph explanations.
--   **SUMMARIZE**: Do not list out all details. Summarize the key finding.
--   **DIRECT ANSWERS**: Get straight to the point.
-
----
-Source Text:
-{context_str}
----
-User's Original Question:
-"{original_question}"
----
-Final, Concise Answer:
-"""
-
         try:
-            # Use generate_content without streaming to get the complete answer
-            response = await self.model.generate_content_async(prompt)
-            return response.text
+            cache_key = self._answer_cache_key(original_question, context_chunks)
+            answer = self._answer_cache.get(cache_key)
+            if answer is not None:
+                return answer
+
+            context_chunks = await self._fit_context_budget(context_chunks, token_counts)
+            context_str = _join_context(tuple(context_chunks))
+            model_name = self._route(original_question, len(context_chunks))
+
+            # Concurrent questions over the same context are coalesced into one call
+            answer = await self._batcher.submit(original_question, context_str, model_name)
+            self._answer_cache.set(cache_key, answer)
+            return answer
             
         except Exception as e:
             print(f"Error in Gemini Synthesis Agent: {e}")
             return "[An error occurred while generating the final answer.]"
 
-    # async def synthesize_final_answer_stream(self, original_question: str, context_chunks: List[str]) -> AsyncGenerator[str, None]:
-    #     """
-    #     Generates a final, high-quality answer by performing an internal
-    #     synthesis, critique, and refinement process, then streams the result.
-    # 
-    #     Args:
-    #         original_question: The user's original, complete question.
-    #         context_chunks: A list of relevant text chunks from the document.
-    # 
-    #     Yields:
-    #         Chunks of the final, refined answer text as they are generated.
-    #     """
-    #     context_str = "\n\n---\n\n".join(context_chunks)
-    #     
-    #     prompt = f"""
-    # You are a precise and factual writing assistant. Your task is to generate a final, high-quality answer to the user's question based ONLY on the provided 'Source Text'.
-    # 
-    # Follow this internal Chain of Thought to construct your response, but DO NOT output the thought process itself. Your final output should only be the answer text.
-    # 
-    # 1.  **Synthesize a Draft**: First, carefully review the 'Source Text' and the 'User's Original Question'. Compose a comprehensive draft answer that directly addresses the question using only the information provided in the source text.
-    # 2.  **Critique the Draft**: Second, critically review your own draft. Ask yourself: "Is every single statement I wrote directly supported by the source text? Did I miss any key details needed to answer the original question completely? Is the answer clear and concise?"
-    # 3.  **Refine and Finalize**: Finally, based on your internal critique, revise the draft to correct any inaccuracies, add any missing information, and improve its clarity.
-    # 
-    # Your final output to the user should be ONLY the refined, polished, and factually-grounded answer. Do not include any of your internal thoughts, drafts, or critiques.
-    # 
-    # ---
-    # Source Text:
-    # {context_str}
-    # ---
-    # User's Original Question:
-    # "{original_question}"
-    # ---
-    # Final Answer:
-    # """
-    # 
-    #     try:
-    #         # Use generate_content with stream=True to get the final answer token-by-token
-    #         response_stream = await self.model.generate_content_async(prompt, stream=True)
-    #         
-    #         async for chunk in response_stream:
-    #             if chunk.text:
-    #                 yield chunk.text
-    #             
-    #     except Exception as e:
-    #         print(f"Error in Gemini Synthesis Agent (Streaming): {e}")
-    #         yield "[An error occurred while generating the final answer.]"
+    @staticmethod
+    def _answer_cache_key(original_question: str, context_chunks: List[str]) -> tuple:
+        """
+        Cache key for an answer: the normalized question plus a hash of the context
+        chunks, independent of their order.
+        """
+        context_hash = hashlib.blake2b("||".join(sorted(context_chunks)).encode(), digest_size=16).digest()
+        return (original_question.strip().lower(), context_hash)
+
+    def _route(self, original_question: str, num_chunks: int) -> str:
+        """
+        Picks the model for a question: short questions over a small context go to
+        the cheaper lite model, everything else to the full model.
+        """
+        if num_chunks <= self.ROUTER_MAX_CHUNKS and len(original_question.split()) <= self.ROUTER_MAX_WORDS:
+            return LITE_MODEL_NAME
+        return MODEL_NAME
+
+    async def _fit_context_budget(self, context_chunks: List[str], token_counts: Optional[List[Optional[int]]] = None) -> List[str]:
+        """
+        Drops exact duplicate chunks, then greedily keeps chunks in their given
+        (relevance) order until the next one would exceed max_context_tokens.
+        The first chunk is always kept. Precomputed token counts are used where
+        given, so only chunks without one cost a count_tokens call.
+        """
+        known_counts = dict(zip(context_chunks, token_counts or []))
+        unique_chunks = list(dict.fromkeys(context_chunks))
+        uncounted_chunks = [chunk for chunk in unique_chunks if known_counts.get(chunk) is None]
+        counted = await asyncio.gather(*[_count_tokens(chunk) for chunk in uncounted_chunks])
+        known_counts.update(zip(uncounted_chunks, counted))
+
+        kept_chunks = []
+        running_total = 0
+        for chunk in unique_chunks:
+            tokens = known_counts[chunk]
+            if kept_chunks and running_total + tokens > self.max_context_tokens:
+                break
+            kept_chunks.append(chunk)
+            running_total += tokens
 
+        if len(kept_chunks) < len(context_chunks):
+            print(f"Context trimmed from {len(context_chunks)} to {len(kept_chunks)} chunks ({running_total} tokens).")
+        return kept_chunks
+
+    async def synthesize_final_answer_stream(self, original_question: str, context_chunks: List[str], token_counts: Optional[List[Optional[int]]] = None) -> AsyncGenerator[str, None]:
+        """
+        Generates a final, high-quality answer by performing an internal
+        synthesis, critique, and refinement process, then streams the result.
+
+        Args:
+            original_question: The user's original, complete question.
+            context_chunks: A list of relevant text chunks from the document.
+            token_counts: Optional per-chunk token counts recorded at ingest.
+
+        Yields:
+            Chunks of the final, refined answer text as they are generated.
+        """
+        try:
+            context_chunks = await self._fit_context_budget(context_chunks, token_counts)
+            context_str = _join_context(tuple(context_chunks))
+            model_name = self._route(original_question, len(context_chunks))
+
+            async for text in self._stream_single(original_question, context_str, model_name):
+                yield text
+
+        except Exception as e:
+            print(f"Error in Gemini Synthesis Agent (Streaming): {e}")
+            yield "[An error occurred while generating the final answer.]"
+
+    async def _generate_single(self, original_question: str, context_str: str, model_name: str = MODEL_NAME) -> str:
+        """
+        Answers one question with one streamed, JSON-constrained Gemini call,
+        assembling the chunks and returning the parsed answer.
+        """
+        # Only the dynamic tail is built per call; the instructions are the system instruction
+        prompt = _PROMPT_HEAD + context_str + _PROMPT_MID + original_question + _PROMPT_JSON_TAIL
+        parts = [text async for text in self._stream_text(prompt, model_name, _ANSWER_GENERATION_CONFIG)]
+        try:
+            return json.loads("".join(parts))["answer"]
+        except (ValueError, KeyError, TypeError) as e:
+            # Usually a response truncated or emptied by max_output_tokens, which thinking
+            # tokens count against; retry once as plain text under a larger fixed cap.
+            # Plain text stays usable even if the retry is cut off as well.
+            print(f"Warning: Unusable JSON answer, retrying as plain text with a larger cap: {e}")
+
+        prompt = _PROMPT_HEAD + context_str + _PROMPT_MID + original_question + _PROMPT_TAIL
+        parts = [text async for text in self._stream_text(prompt, model_name, _FALLBACK_GENERATION_CONFIG)]
+        answer = "".join(parts).strip()
+        if not answer:
+            raise ValueError("Gemini returned an empty answer")
+        return answer
+
+    async def _stream_single(self, original_question: str, context_str: str, model_name: str = MODEL_NAME) -> AsyncGenerator[str, None]:
+        """
+        Answers one question with one Gemini call, yielding plain answer text as it is
+        generated (partial JSON could not be forwarded to a client as it streams).
+        """
+        prompt = _PROMPT_HEAD + context_str + _PROMPT_MID + original_question + _PROMPT_TAIL
+        async for text in self._stream_text(prompt, model_name, _STREAM_GENERATION_CONFIG):
+            yield text
+
+    async def _stream_text(self, prompt: str, model_name: str, generation_config: Optional[genai.GenerationConfig] = None) -> AsyncGenerator[str, None]:
+        """
+        Sends a prompt to the given model and yields the response text as it is generated.
+        """
+        gemini_model = _get_model(model_name)
+        # Stream so the first tokens are available before generation completes
+        response_stream = await gemini_model.model.generate_content_async(
+            prompt,
+            generation_config=generation_config,
+            stream=True
+        )
+        async for chunk in response_stream:
+            # Chunks without text parts (e.g. one carrying only the finish reason) are skipped
+            try:
+                text = chunk.text
+            except ValueError:
+                continue
+            if text:
+                yield text
+
+    async def _generate_batch(self, questions: List[str], context_str: str, model_name: str = MODEL_NAME) -> List[str]:
+        """
+        Answers several questions sharing the same Source Text in one Gemini call, so
+        the context is prefilled once. Raises if the response does not contain
+        exactly one answer per question.
+        """
+        questions_text = "\n".join(f"{i+1}. {question}" for i, question in enumerate(questions))
+        prompt = _PROMPT_HEAD + context_str + _BATCH_PROMPT_MID + questions_text + _BATCH_PROMPT_TAIL
+        response = await _get_model(model_name).model.generate_content_async(
+            prompt,
+            generation_config=genai.GenerationConfig(
+                max_output_tokens=MAX_ANSWER_TOKENS * len(questions),
+                temperature=ANSWER_TEMPERATURE,
+                candidate_count=1,
+                response_mime_type="application/json"
+            )
+        )
+        answers = json.loads(response.text).get("answers")
+        if not isinstance(answers, list) or len(answers) != len(questions):
+            raise ValueError(f"Expected {len(questions)} answers in batched response, got: {answers!r}")
+        return [str(answer) for answer in answers]